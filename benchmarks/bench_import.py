@@ -0,0 +1,119 @@
+#
+# bench_import.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import os
+import sys
+import subprocess
+import optparse
+
+
+PACKAGE_DIR = os.path.join(
+  os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "movetools")
+
+# Modules that can be imported without Deluge being installed
+MODULES = ("common", "rules", "scheduling", "dedup")
+
+# Modules that must not be imported as a side effect of loading the plugin
+FORBIDDEN = ("pkg_resources",)
+
+IMPORT_SCRIPT = """
+import sys
+import time
+
+try:
+  import __builtin__ as builtins
+except ImportError:
+  import builtins
+
+builtins._ = lambda s: s
+sys.path.insert(0, %r)
+
+start = time.time()
+for name in %r:
+  __import__(name)
+elapsed = time.time() - start
+
+loaded = [name for name in %r if name in sys.modules]
+sys.stdout.write("%%f %%s\\n" %% (elapsed, ",".join(loaded)))
+"""
+
+
+def measure(modules):
+  script = IMPORT_SCRIPT % (PACKAGE_DIR, modules, FORBIDDEN)
+  output = subprocess.check_output([sys.executable, "-c", script])
+  elapsed, loaded = output.decode().split(" ")
+  return float(elapsed), [name for name in loaded.strip().split(",") if name]
+
+
+def main():
+  parser = optparse.OptionParser(
+    usage="%prog [options]",
+    description="Measure the time taken to import the plugin modules.")
+  parser.add_option("-n", "--runs", type="int", default=10,
+    help="number of runs (default: %default)")
+  parser.add_option("-m", "--max-ms", type="float", default=50.0,
+    help="fail if the median import time exceeds this (default: %default)")
+  options, args = parser.parse_args()
+
+  times = []
+  for i in range(options.runs):
+    elapsed, loaded = measure(MODULES)
+    if loaded:
+      sys.stderr.write("FAIL: importing the plugin imports %s\n" %
+        ", ".join(loaded))
+      return 1
+
+    times.append(elapsed*1000)
+
+  times.sort()
+  median = times[len(times)//2]
+  sys.stdout.write("Import time (ms): median %.2f, min %.2f, max %.2f\n" %
+    (median, times[0], times[-1]))
+
+  if median > options.max_ms:
+    sys.stderr.write("FAIL: median import time exceeds %.2f ms\n" %
+      options.max_ms)
+    return 1
+
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
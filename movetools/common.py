@@ -40,7 +40,7 @@
 
 import copy
 import os
-import pkg_resources
+import errno
 
 
 PLUGIN_NAME = "MoveTools"
@@ -52,10 +52,107 @@ STATUS_MESSAGE = "%s_message" % MODULE_NAME
 
 
 def get_resource(filename):
+  path = os.path.join(os.path.dirname(__file__), "data", filename)
+  if os.path.isfile(path):
+    return path
+
+  # Resources in a zipped egg need to be extracted, which is only
+  # supported by pkg_resources. It is imported here because importing it
+  # scans every installed distribution.
+  import pkg_resources
   return pkg_resources.resource_filename(
       MODULE_NAME, os.path.join("data", filename))
 
 
+def get_existing_path(path):
+  while path and not os.path.exists(path):
+    parent = os.path.dirname(path)
+    if parent == path:
+      break
+    path = parent
+
+  return path
+
+
+def get_device(path):
+  try:
+    return os.stat(get_existing_path(path)).st_dev
+  except OSError:
+    return None
+
+
+def get_stage_path(path, id):
+  # Files set aside stay on the same device as the torrent, but outside of
+  # its folder so that moving the storage leaves them behind
+  return os.path.join(path, ".%s.%s" % (MODULE_NAME, id))
+
+
+def rename_file(src, dest):
+  parent = os.path.dirname(dest)
+  if not os.path.isdir(parent):
+    os.makedirs(parent)
+
+  os.rename(src, dest)
+
+
+def remove_empty_dirs(path):
+  for root, dirs, files in os.walk(path, topdown=False):
+    try:
+      os.rmdir(root)
+    except OSError:
+      pass
+
+
+def remove_empty_parents(root, paths):
+  # Remove folders of the torrent that were left empty, deepest first
+  dirs = set(os.path.dirname(path) for path in paths)
+  for path in sorted(dirs, key=len, reverse=True):
+    while path:
+      try:
+        os.rmdir(os.path.join(root, path))
+      except OSError:
+        break
+      path = os.path.dirname(path)
+
+
+def remove_files(root, paths):
+  for path in paths:
+    try:
+      os.remove(os.path.join(root, path))
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+
+  remove_empty_parents(root, paths)
+
+
+def stage_files(root, stage_path, paths):
+  for path in paths:
+    rename_file(os.path.join(root, path), os.path.join(stage_path, path))
+
+  remove_empty_parents(root, paths)
+
+
+def restore_files(root, stage_path, paths):
+  # Every file is attempted so that one failure does not strand the rest
+  error = None
+  for path in paths:
+    try:
+      rename_file(os.path.join(stage_path, path), os.path.join(root, path))
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        error = error or e
+
+  remove_empty_dirs(stage_path)
+  if error:
+    raise error
+
+
+def discard_files(stage_path, paths):
+  remove_files(stage_path, paths)
+  remove_empty_dirs(stage_path)
+
+
 def normalize_dict(dict_in, template):
 
   for key in dict_in.keys():
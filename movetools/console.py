@@ -0,0 +1,214 @@
+#
+# console.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import sys
+import optparse
+
+from twisted.internet import reactor
+
+from deluge.ui.client import client
+import deluge.log
+
+
+DEFAULT_PORT = 58846
+POLL_INTERVAL = 2.0
+
+
+def write(id, state):
+  sys.stdout.write("%s %s\n" % (id, state))
+  sys.stdout.flush()
+
+
+def get_state(status):
+  message = status["message"]
+  if status["status"] == "Moving":
+    percent = message.rpartition(" ")[2]
+    if status.get("eta") is not None:
+      return "moving %s%% eta %ds" % (percent, status["eta"])
+    return "moving %s%%" % percent
+  if status["status"] == "Queued":
+    return "queued"
+  if status["status"] == "Done":
+    return "done"
+
+  return "error: %s" % message.partition(": ")[2]
+
+
+class MoveCommand(object):
+
+  def __init__(self, options, ids):
+    self.options = options
+    self.ids = ids
+    self.pending = {}
+    self.failed = 0
+
+  def run(self):
+    host, _sep, port = self.options.daemon.partition(":")
+    d = client.connect(host, int(port or DEFAULT_PORT),
+      self.options.username, self.options.password)
+    d.addCallback(self._on_connected)
+    d.addErrback(self._on_error)
+
+    reactor.run()
+    return 1 if self.failed else 0
+
+  def _on_connected(self, result):
+    filters = {}
+    if self.options.state:
+      filters["state"] = self.options.state
+    if self.options.label:
+      filters["label"] = self.options.label
+    if self.options.tracker:
+      filters["tracker_host"] = self.options.tracker
+
+    if not filters:
+      return self._submit(self.ids)
+
+    d = client.core.get_torrents_status(filters, ["name"])
+    d.addCallback(self._on_filtered)
+    return d
+
+  def _on_filtered(self, torrents):
+    ids = torrents.keys()
+    if self.ids:
+      ids = [id for id in self.ids if id in torrents]
+
+    return self._submit(ids)
+
+  def _submit(self, ids):
+    if not ids:
+      sys.stderr.write("No torrents to move\n")
+      return self._finish()
+
+    d = client.movetools.move_completed(ids, True)
+    d.addCallback(self._on_submitted)
+    return d
+
+  def _on_submitted(self, results):
+    for id, result in sorted(results.iteritems()):
+      if result == "queued":
+        self.pending[id] = None
+      else:
+        self.failed += 1
+        write(id, "error: %s" % result)
+
+    self._poll()
+
+  def _poll(self):
+    if not self.pending:
+      return self._finish()
+
+    d = client.movetools.get_job_status(self.pending.keys())
+    d.addCallback(self._on_status)
+    d.addErrback(self._on_error)
+
+  def _on_status(self, statuses):
+    for id, status in statuses.iteritems():
+      if status["status"] is None:
+        # The job was canceled or its result cleared before it was seen
+        del self.pending[id]
+        self.failed += 1
+        write(id, "error: removed")
+        continue
+
+      state = get_state(status)
+      if state != self.pending[id]:
+        self.pending[id] = state
+        write(id, state)
+
+      if status["status"] == "Done":
+        del self.pending[id]
+      elif status["status"] == "Error":
+        del self.pending[id]
+        self.failed += 1
+
+    reactor.callLater(self.options.interval, self._poll)
+
+  def _on_error(self, failure):
+    sys.stderr.write("Error: %s\n" % failure.getErrorMessage())
+    self.failed += 1
+    self._finish()
+
+  def _finish(self):
+    if client.connected():
+      client.disconnect()
+
+    if reactor.running:
+      reactor.callLater(0, reactor.stop)
+
+
+def main(args=None):
+  parser = optparse.OptionParser(
+    usage="%prog [options] [ID ...]",
+    description="Move completed torrents to their move completed path and "
+      "report progress until every move ends. Torrent ids are read from "
+      "the arguments, or from stdin if none are given or an id is '-'. "
+      "Filters select torrents from the daemon, limited to the given ids "
+      "if any. Exits with 1 if any move fails.")
+  parser.add_option("-d", "--daemon", default="127.0.0.1:%d" % DEFAULT_PORT,
+    help="daemon to connect to as host[:port] (default: %default)")
+  parser.add_option("-u", "--username", default="",
+    help="daemon username")
+  parser.add_option("-p", "--password", default="",
+    help="daemon password")
+  parser.add_option("-s", "--state",
+    help="select torrents in this state, e.g. Seeding")
+  parser.add_option("-l", "--label",
+    help="select torrents with this label")
+  parser.add_option("-t", "--tracker",
+    help="select torrents with this tracker host")
+  parser.add_option("-i", "--interval", type="float", default=POLL_INTERVAL,
+    help="seconds between progress updates (default: %default)")
+  parser.add_option("-L", "--loglevel", default="error",
+    help="log level (default: %default)")
+  options, args = parser.parse_args(args)
+
+  deluge.log.setupLogger(options.loglevel)
+
+  ids = [id for id in args if id != "-"]
+  filtered = options.state or options.label or options.tracker
+  if "-" in args or not (args or filtered):
+    ids.extend(line.strip() for line in sys.stdin if line.strip())
+
+  return MoveCommand(options, ids).run()
+
+
+if __name__ == "__main__":
+  sys.exit(main())
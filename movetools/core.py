@@ -44,7 +44,14 @@ import os.path
 import copy
 import logging
 
+from collections import OrderedDict
+
 from twisted.internet import reactor
+from twisted.internet.task import cooperate
+from twisted.internet.task import TaskStopped
+from twisted.internet.task import TaskFinished
+from twisted.internet.threads import deferToThread
+from twisted.internet.defer import succeed
 
 from deluge.plugins.pluginbase import CorePluginBase
 import deluge.component as component
@@ -57,9 +64,33 @@ from common import MODULE_NAME
 from common import STATUS_NAME
 from common import STATUS_MESSAGE
 from common import normalize_dict
+from common import get_device
+from common import get_stage_path
+from common import discard_files
+from common import remove_files
+from common import restore_files
+from rules import RuleMatcher
+from rules import get_free_space
+from rules import get_extension
+from scheduling import LoadMonitor
+from scheduling import parse_windows
+from scheduling import in_windows
+from dedup import DedupIndex
+from dedup import materialize
+from recorder import TraceRecorder
+from tracing import JobTracer
+from lease import LeaseManager
+from tiering import TieringPolicy
+from retry import get_error_code
+from retry import classify_error
+from retry import get_retry_delay
+from transfer import ParallelTransfer
+from stalls import Watchdog
+from stalls import timed
 
 
 CONFIG_FILE = "%s.conf" % MODULE_NAME
+TRACE_FILE = "%s_trace.jsonl" % MODULE_NAME
 
 DEFAULT_PREFS = {
   "general": {
@@ -70,6 +101,74 @@ DEFAULT_PREFS = {
     "success": -1.0,
     "error": -1.0,
   },
+  "rules": {
+    "enabled": False,
+    "batch_window": 5.0,
+    "rules": [],
+  },
+  "scheduling": {
+    "max_upload_rate": 0,
+    "max_disk_read_rate": 0,
+    "max_disk_write_rate": 0,
+    "small_job_size": 256*2**20,
+    "large_job_size": 50*2**30,
+    "large_job_windows": [],
+  },
+  "dedup": {
+    "enabled": False,
+    "link_mode": "hardlink",
+    "verify": True,
+    "sample_count": 4,
+    "sample_size": 64*2**10,
+    "min_file_size": 2**20,
+    "history": 1000,
+  },
+  "recorder": {
+    "enabled": False,
+    "path": "",
+  },
+  "tracing": {
+    "enabled": False,
+    "buffer_size": 100000,
+  },
+  "coordination": {
+    "enabled": False,
+    "lock_dir": "",
+    "max_per_device": 1,
+    "heartbeat": 30.0,
+    "stale_timeout": 300.0,
+  },
+  "tiering": {
+    "enabled": False,
+    "fast_path": "",
+    "slow_path": "",
+    "cold_days": 7,
+    "sample_interval": 3600.0,
+    "max_upload_rate": 1024,
+    "max_peers": 0,
+    "promote": False,
+    "promote_upload_rate": 100*2**10,
+    "promote_samples": 6,
+    "daily_budget": 0,
+  },
+  "retry": {
+    "max_retries": 3,
+    "base_delay": 30.0,
+    "max_delay": 900.0,
+  },
+  "transfer": {
+    "enabled": False,
+    "min_files": 1000,
+    "large_file_size": 64*2**20,
+    "workers": 4,
+    "device_workers": {},
+  },
+  "watchdog": {
+    "enabled": False,
+    "threshold": 0.1,
+    "interval": 0.5,
+    "history": 100,
+  },
 }
 
 INIT_FILTERS = lambda: {
@@ -83,45 +182,88 @@ ALIVE_STATUS = ("Moving", "Queued")
 
 UPDATE_INTERVAL = 2.0
 
+WATCHDOG_REPORT_SIZE = 20
+
+WATCH_TIMEOUT = 3600.0
+
+BLOCK_SIZE = 512
+
+TIERING_KEYS = ["save_path", "total_size", "total_uploaded", "num_peers",
+  "is_finished"]
+
 
 log = logging.getLogger(__name__)
 
 
-def get_total_size(paths):
-  size = 0
-  for path in paths:
-    try:
-      if os.path.exists(path):
-        size += os.path.getsize(path)
-    except OSError:
-      pass
+def get_file_size(path):
+  try:
+    return os.path.getsize(path)
+  except OSError:
+    return 0
+
+
+def restore_staged(src_path, dest_path, stage_path, staged, created):
+  remove_files(dest_path, created)
+  restore_files(src_path, stage_path, staged)
+
 
-  return size
+def get_allocated_size(path):
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return 0
+
+  # Blocks reflect the data written to sparse and preallocated files
+  blocks = getattr(stat, "st_blocks", None)
+  if blocks is None:
+    return stat.st_size
+
+  return min(blocks*BLOCK_SIZE, stat.st_size)
 
 
 class Progress(object):
 
   def __init__(self, torrent, dest_path):
     self.torrent = torrent
+    self.queued_time = time.time()
     self._start_time = None
     self._end_time = None
 
     self.status = "Queued"
     self.message = "Queued"
+    self.deferred = False
 
     self.src_path = torrent.get_status(["save_path"])["save_path"]
     self.dest_path = dest_path
 
     files = torrent.get_files()
+    self.files = tuple((f["path"], f["size"]) for f in files)
 
-    src_paths = (os.path.join(self.src_path, f["path"]) for f in files)
-    self.total_size = get_total_size(src_paths)
+    self._sizes = tuple(get_file_size(os.path.join(self.src_path, f["path"]))
+      for f in files)
+    self.total_size = sum(self._sizes)
 
     self._paths = tuple(os.path.join(dest_path, f["path"]) for f in files)
+    self._current = 0
+    self._allocated = None
+    self._completed = 0
     self.size = 0
 
     self.percent = 0.0
     self._estimated_speed = None
+    self._first_sample = None
+    self._last_sample = None
+
+    self.devices = None
+    self.cross_device = None
+    self.dedup_matches = ()
+    self.linked_size = 0
+    self.staged = []
+    self.created = []
+    self.restoring = False
+    self.lease = None
+    self.retries = 0
+    self.transfer = None
 
   def start(self, estimated_speed):
     self.status = "Moving"
@@ -129,6 +271,12 @@ class Progress(object):
     self._start_time = time.time()
     self._estimated_speed = estimated_speed
 
+    self._current = 0
+    self._allocated = None
+    self._completed = 0
+    self._first_sample = None
+    self._last_sample = None
+
   def finish(self):
     self._end_time = time.time()
     self.size = self.total_size
@@ -144,14 +292,41 @@ class Progress(object):
   def get_avg_speed(self):
     return self.size/(self.get_elapsed() or 1)
 
+  def get_measured_speed(self):
+    if not (self._first_sample and self._last_sample):
+      return None
+
+    elapsed = self._last_sample[0] - self._first_sample[0]
+    if elapsed < UPDATE_INTERVAL:
+      return None
+
+    return (self._last_sample[1] - self._first_sample[1]) / elapsed
+
+  def get_eta(self):
+    if self.status != "Moving":
+      return None
+
+    speed = self.get_measured_speed() or self._estimated_speed
+    return max(self.total_size - self.size, 0) / float(speed or 1)
+
   def update(self):
     self._update_progress()
     self._update_status()
 
   def _update_progress(self):
-    size = get_total_size(self._paths)
-    if size == self.total_size:
-      # OS reported full size, so use estimation
+    if self.transfer:
+      self.size = self.linked_size + self.transfer.copied
+      self.percent = float(self.size) / (self.total_size or 1) * 100
+      return
+
+    size = self._get_written_size()
+    if size < self.total_size:
+      sample = (time.time(), size)
+      if not self._first_sample:
+        self._first_sample = sample
+      self._last_sample = sample
+    elif not self._first_sample:
+      # Full size reported from the start, so use estimation
       size = self._estimated_speed * self.get_elapsed()
       if size > self.total_size:
         size = self.total_size
@@ -159,6 +334,32 @@ class Progress(object):
     self.size = size
     self.percent = float(self.size) / (self.total_size or 1) * 100
 
+  def _get_written_size(self):
+    # Files are written in torrent order, so only the current file needs to
+    # be checked
+    while self._current < len(self._paths):
+      size = self._sizes[self._current]
+      if size:
+        path = self._paths[self._current]
+        written = get_allocated_size(path)
+        if written < size and not self._is_file_done(path, size, written):
+          self._allocated = written
+          return self._completed + written
+
+      self._completed += size
+      self._current += 1
+      self._allocated = None
+
+    return self._completed
+
+  def _is_file_done(self, path, size, written):
+    # Files that are compressed or sparse may never be fully allocated, so
+    # a file at full length that stopped growing is taken as written
+    if not written or written != self._allocated:
+      return False
+
+    return get_file_size(path) >= size
+
   def _update_status(self):
     if self.status == "Moving":
       if self.percent < 100.0:
@@ -166,7 +367,22 @@ class Progress(object):
       else:
         percent_str = "99.99"
 
-      self.message = "Moving %s" % percent_str
+      if self.retries:
+        self.message = "Moving (retry %d) %s" % (self.retries, percent_str)
+      else:
+        self.message = "Moving %s" % percent_str
+
+
+class Admission(object):
+
+  def __init__(self, ids):
+    self.ids = ids
+    self.results = {}
+    self.canceled = set()
+    self.task = None
+
+  def get_message(self):
+    return "Queued: admitting %d/%d" % (len(self.results), len(self.ids))
 
 
 class Core(CorePluginBase):
@@ -190,43 +406,54 @@ class Core(CorePluginBase):
   def _initialize(self):
 
     def move_storage(torrent, dest_path):
-      id = str(torrent.handle.info_hash())
-      log.debug("[%s] Queueing (%s)", PLUGIN_NAME, id)
-
-      if id in self.torrents:
-        if self.torrents[id].status in ALIVE_STATUS:
-          log.debug("[%s] Unable to move torrent: already moving", PLUGIN_NAME)
-          return False
-        else:
-          self._remove_job(id)
-
-      self.torrents[id] = Progress(torrent, dest_path)
-
-      if not dest_path:
-        self._report_result(id, "error", "Error", "Empty path")
-        return False
-
-      if self.torrents[id].src_path == dest_path:
-        self._report_result(id, "error", "Error", "Same path")
-        return False
-
-      self.queue.append(id)
-      return True
+      return self._queue_job(torrent, dest_path) == "queued"
 
     self.config = deluge.configmanager.ConfigManager(CONFIG_FILE,
       copy.deepcopy(DEFAULT_PREFS))
 
+    for section in DEFAULT_PREFS:
+      normalize_dict(self.config[section], DEFAULT_PREFS[section])
+
     self.general = self.config["general"]
     self.timeout = self.config["timeout"]
 
-    normalize_dict(self.general, DEFAULT_PREFS["general"])
-    normalize_dict(self.timeout, DEFAULT_PREFS["timeout"])
-
     self.torrents = {}
     self.calls = {}
+    self.watched = set()
+    self.expired = set()
+    self.retry_calls = {}
     self.queue = []
     self.active = None
 
+    self.admissions = []
+    self.admitting = {}
+
+    self.rules = RuleMatcher(self.config["rules"]["rules"])
+    self.finished = []
+    self.dispatch_call = None
+
+    self.dedup_index = DedupIndex(self.config["dedup"]["history"])
+    self.recorder = TraceRecorder(self._get_trace_path())
+    self.tracer = JobTracer(self.config["tracing"]["buffer_size"])
+    self.tracer.enabled = self.config["tracing"]["enabled"]
+    self.load = LoadMonitor()
+    self.windows = parse_windows(
+      self.config["scheduling"]["large_job_windows"])
+
+    self.leases = None
+    self._setup_coordination()
+
+    self.tiering = TieringPolicy(self.config["tiering"])
+    self.tiering_call = None
+
+    self.watchdog = Watchdog(self.config["watchdog"]["threshold"],
+      self.config["watchdog"]["interval"], self.config["watchdog"]["history"])
+    if self.config["watchdog"]["enabled"]:
+      self.watchdog.start()
+
+    deluge.component.get("EventManager").register_event_handler(
+      "TorrentFinishedEvent", self._on_torrent_finished)
+
     component.get("AlertManager").register_handler("storage_moved_alert",
       self.on_storage_moved)
     component.get("AlertManager").register_handler(
@@ -248,6 +475,7 @@ class Core(CorePluginBase):
     log.debug("[%s] Core enabled", PLUGIN_NAME)
 
     self._update_loop()
+    self._tiering_loop()
 
   def disable(self):
     log.debug("[%s] Disabling Core...", PLUGIN_NAME)
@@ -256,11 +484,35 @@ class Core(CorePluginBase):
 
     deluge.component.get("EventManager").deregister_event_handler(
       "SessionStartedEvent", self._on_session_started)
+    deluge.component.get("EventManager").deregister_event_handler(
+      "TorrentFinishedEvent", self._on_torrent_finished)
+
+    if self.dispatch_call and self.dispatch_call.active():
+      self.dispatch_call.cancel()
+
+    if self.tiering_call and self.tiering_call.active():
+      self.tiering_call.cancel()
+
+    self.watchdog.stop()
 
     Torrent.move_storage = self.orig_move_storage
 
     for id in self.torrents:
       self._cancel_remove(id)
+      self._cancel_retry(id)
+      self._release_lease(self.torrents[id])
+
+      if self.torrents[id].transfer:
+        self.torrents[id].transfer.stop()
+
+    for admission in self.admissions[:]:
+      try:
+        admission.task.stop()
+      except TaskFinished:
+        pass
+
+    if self.leases:
+      self.leases.release_all()
 
     component.get("FilterManager").deregister_tree_field(STATUS_NAME)
 
@@ -284,20 +536,50 @@ class Core(CorePluginBase):
     return self.initialized
 
   @export
+  @timed
   def set_settings(self, options):
     log.debug("[%s] Setting options", PLUGIN_NAME)
-    self.general.update(options["general"])
-    self.timeout.update(options["timeout"])
+    for section in options:
+      if section in DEFAULT_PREFS:
+        self.config[section].update(options[section])
+
+    if "rules" in options:
+      self.rules = RuleMatcher(self.config["rules"]["rules"])
+
+    if "coordination" in options:
+      self._setup_coordination()
+
+    if "tracing" in options:
+      self.tracer.enabled = self.config["tracing"]["enabled"]
+      self.tracer.resize(self.config["tracing"]["buffer_size"])
+
+    if "recorder" in options:
+      self.recorder.path = self._get_trace_path()
+
+    if "dedup" in options:
+      self.dedup_index.history = self.config["dedup"]["history"]
+
+    if "scheduling" in options:
+      self.windows = parse_windows(
+        self.config["scheduling"]["large_job_windows"])
+
+    if "watchdog" in options:
+      self.watchdog.threshold = self.config["watchdog"]["threshold"]
+      self.watchdog.interval = self.config["watchdog"]["interval"]
+      self.watchdog.resize(self.config["watchdog"]["history"])
+      if self.config["watchdog"]["enabled"]:
+        self.watchdog.start()
+      else:
+        self.watchdog.stop()
 
   @export
+  @timed
   def get_settings(self):
     log.debug("[%s] Getting options", PLUGIN_NAME)
-    return {
-      "general": self.general,
-      "timeout": self.timeout,
-    }
+    return dict((section, self.config[section]) for section in DEFAULT_PREFS)
 
   @export
+  @timed
   def clear_selected(self, ids):
     log.debug("[%s] Clearing status results for: %s", PLUGIN_NAME, ids)
     for id in ids:
@@ -305,6 +587,7 @@ class Core(CorePluginBase):
         self._remove_job(id)
 
   @export
+  @timed
   def clear_all_status(self):
     log.debug("[%s] Clearing all status results", PLUGIN_NAME)
     for id in self.torrents.keys():
@@ -312,89 +595,744 @@ class Core(CorePluginBase):
         self._remove_job(id)
 
   @export
-  def move_completed(self, ids):
+  @timed
+  def move_completed(self, ids, watch=False):
     log.debug("[%s] Moving completed torrents in: %s", PLUGIN_NAME, ids)
+
+    def admit(torrent):
+      if not torrent.handle.is_finished():
+        return "not finished"
+
+      result = self._queue_job(torrent,
+        torrent.options["move_completed_path"])
+      if watch and result == "queued":
+        self.watched.add(torrent.torrent_id)
+      return result
+
+    return self._admit(ids, admit)
+
+  @export
+  @timed
+  def get_job_status(self, ids):
+    results = {}
+    for id in ids:
+      results[id] = {
+        "status": self.get_move_status(id),
+        "message": self.get_move_message(id),
+        "eta": self.torrents[id].get_eta() if id in self.torrents else None,
+      }
+
+      if id in self.watched and results[id]["status"] in ("Done", "Error"):
+        self.watched.discard(id)
+        if id in self.expired:
+          self._remove_job(id)
+
+    return results
+
+  @export
+  @timed
+  def test_rules(self, ids):
+    log.debug("[%s] Testing rules for: %s", PLUGIN_NAME, ids)
     torrents = component.get("TorrentManager").torrents
+    results = {}
     for id in ids:
       if id in torrents:
-        torrent = torrents[id]
-        if torrent.handle.is_finished():
-          dest_path = torrent.options["move_completed_path"]
-          torrent.move_storage(dest_path)
+        rule = self._match_rule(torrents[id])
+        results[id] = rule.to_dict() if rule else None
+
+    return results
+
+  @export
+  @timed
+  def get_trace(self):
+    log.debug("[%s] Getting job trace", PLUGIN_NAME)
+    return self.tracer.to_chrome()
+
+  @export
+  @timed
+  def clear_trace(self):
+    log.debug("[%s] Clearing job trace", PLUGIN_NAME)
+    self.tracer.clear()
+
+  @export
+  def get_watchdog_report(self, count=WATCHDOG_REPORT_SIZE):
+    log.debug("[%s] Getting watchdog report", PLUGIN_NAME)
+    return self.watchdog.get_report(count)
 
   @export
+  def clear_watchdog_report(self):
+    log.debug("[%s] Clearing watchdog report", PLUGIN_NAME)
+    self.watchdog.clear()
+
+  @export
+  @timed
   def cancel_pending(self, ids):
     log.debug("[%s] Canceling pending move for: %s", PLUGIN_NAME, ids)
     for id in ids:
+      if id in self.admitting:
+        self.admitting.pop(id).canceled.add(id)
+
       if id in self.torrents and self.torrents[id].status == "Queued":
         self._remove_job(id)
 
+  @timed
   def on_storage_moved(self, alert):
     id = str(alert.handle.info_hash())
     if id in self.torrents:
       self.active = None
       self.torrents[id].finish()
+      d = self._discard_staged(id, self.torrents[id])
+      self._trace_end(id, "storage_moved_alert")
       self._report_result(id, "success", "Done")
 
-      if self.torrents[id].size >= self.config["general"]["estimated_speed"]*2:
-        speed = self.torrents[id].get_avg_speed()
+      # Moves within a device are renames, which say nothing about the
+      # speed of copies
+      job = self.torrents[id]
+      if job.cross_device and \
+          job.size >= self.config["general"]["estimated_speed"]*2:
+        speed = job.get_measured_speed() or job.get_avg_speed()
         self.config["general"]["estimated_speed"] = \
           int((self.config["general"]["estimated_speed"]*0.5 + speed*1.5)/2)
         log.debug("[%s] New estimated speed: %r B/s", PLUGIN_NAME,
           self.config["general"]["estimated_speed"])
 
+      # The folder of files set aside has to be gone before the source
+      # path can be empty
       if self.general["remove_empty"]:
-        try:
-          log.debug("[%s] Removing empty folders in path: %s", PLUGIN_NAME,
-            self.torrents[id].src_path)
-          os.removedirs(self.torrents[id].src_path)
-        except OSError:
-          pass
+        d.addCallback(self._remove_empty, job.src_path)
 
+  @timed
   def on_storage_moved_failed(self, alert):
     id = str(alert.handle.info_hash())
     if id in self.torrents:
       self.active = None
       message = alert.message().rpartition(":")[2].strip()
-      self._report_result(id, "error", "Error", message)
+      self._trace_end(id, "storage_moved_failed_alert", {"message": message})
+      self._fail_job(id, message, get_error_code(alert))
+
+  @timed
+  def _on_torrent_finished(self, id):
+    if not self.config["rules"]["enabled"]:
+      return
+
+    log.debug("[%s] Torrent finished (%s)", PLUGIN_NAME, id)
+    self.finished.append(id)
+
+    if not (self.dispatch_call and self.dispatch_call.active()):
+      self.dispatch_call = reactor.callLater(
+        self.config["rules"]["batch_window"], self._dispatch_finished)
+
+  @timed
+  def _dispatch_finished(self):
+    ids = self.finished
+    self.finished = []
+
+    if not self.initialized or not self.config["rules"]["enabled"]:
+      return
+
+    log.debug("[%s] Dispatching %d finished torrents", PLUGIN_NAME, len(ids))
+
+    # Torrents routed earlier in the batch have not been moved yet, so their
+    # size is taken from the free space of their destination
+    free_space = {}
+    def get_cached_free_space(path):
+      if path not in free_space:
+        free_space[path] = get_free_space(path)
+      return free_space[path]
+
+    def admit(torrent):
+      if torrent.options["move_completed"]:
+        return "move completed set"
+
+      rule = self._match_rule(torrent, get_cached_free_space)
+      if not rule:
+        return "no rule"
+
+      log.debug("[%s] Torrent (%s) matched rule: %s", PLUGIN_NAME,
+        torrent.torrent_id, rule.name)
+      result = self._queue_job(torrent, rule.dest_path)
+      if result == "queued" and free_space.get(rule.dest_path) is not None:
+        job = self.torrents[torrent.torrent_id]
+        free_space[rule.dest_path] -= job.total_size
+
+      return result
 
+    self._admit(list(OrderedDict.fromkeys(ids)), admit)
+
+  def _match_rule(self, torrent, get_free_space=get_free_space):
+    if not self.rules:
+      return None
+
+    id = str(torrent.handle.info_hash())
+    keys = ["total_size"]
+    if self.rules.needs_label:
+      keys.append("label")
+    if self.rules.needs_tracker:
+      keys.append("tracker_host")
+
+    status = component.get("Core").get_torrent_status(id, keys)
+
+    extensions = {}
+    if self.rules.needs_extensions:
+      for f in torrent.get_files():
+        ext = get_extension(f["path"])
+        extensions[ext] = extensions.get(ext, 0) + f["size"]
+
+    info = {
+      "label": (status.get("label") or "").lower(),
+      "tracker": (status.get("tracker_host") or "").lower(),
+      "size": status["total_size"],
+      "extensions": extensions,
+    }
+
+    return self.rules.match(info, get_free_space)
+
+  @timed
   def get_move_status(self, id):
+    if id in self.admitting and not self._is_alive(id):
+      return "Queued"
+
     if id not in self.torrents:
       return None
 
     return self.torrents[id].status
 
+  @timed
   def get_move_message(self, id):
+    if id in self.admitting and not self._is_alive(id):
+      return self.admitting[id].get_message()
+
     if id not in self.torrents:
       return None
 
     return self.torrents[id].message
 
+  def _is_alive(self, id):
+    return id in self.torrents and self.torrents[id].status in ALIVE_STATUS
+
+  def _queue_job(self, torrent, dest_path):
+    id = str(torrent.handle.info_hash())
+    log.debug("[%s] Queueing (%s)", PLUGIN_NAME, id)
+
+    if id in self.torrents:
+      if self.torrents[id].status in ALIVE_STATUS:
+        log.debug("[%s] Unable to move torrent: already moving", PLUGIN_NAME)
+        return "already moving"
+      else:
+        self._remove_job(id)
+
+    self.torrents[id] = Progress(torrent, dest_path)
+
+    if not dest_path:
+      self._report_result(id, "error", "Error", "Empty path")
+      return "empty path"
+
+    if self.torrents[id].src_path == dest_path:
+      self._report_result(id, "error", "Error", "Same path")
+      return "same path"
+
+    self.queue.append(id)
+    self._index_job(id)
+    self.tracer.instant("queued", id, {"dest_path": dest_path})
+    return "queued"
+
+  def _admit(self, ids, admit):
+    admission = Admission(ids)
+    for id in ids:
+      self.admitting[id] = admission
+
+    def process():
+      torrents = component.get("TorrentManager").torrents
+      for id in ids:
+        admission.results[id] = self._admit_torrent(admission, torrents, id,
+          admit)
+        yield None
+
+    def on_stopped(failure):
+      failure.trap(TaskStopped)
+      return admission.results
+
+    def on_finished(result):
+      self.admissions.remove(admission)
+      for id in ids:
+        if self.admitting.get(id) is admission:
+          del self.admitting[id]
+
+      return result
+
+    def on_done(result):
+      log.debug("[%s] Admitted %d of %d torrents", PLUGIN_NAME,
+        admission.results.values().count("queued"), len(ids))
+      return admission.results
+
+    self.admissions.append(admission)
+
+    # Admission is done a few torrents per reactor iteration so that large
+    # batches do not block the daemon
+    admission.task = cooperate(process())
+
+    d = admission.task.whenDone()
+    d.addErrback(on_stopped)
+    d.addBoth(on_finished)
+    d.addCallback(on_done)
+    return d
+
+  @timed
+  def _admit_torrent(self, admission, torrents, id, admit):
+    if self.admitting.get(id) is admission:
+      del self.admitting[id]
+
+    if id in admission.canceled:
+      return "canceled"
+    if id not in torrents:
+      return "not found"
+
+    # An error for one torrent must not end the admission of the rest
+    try:
+      return admit(torrents[id])
+    except Exception as e:
+      log.error("[%s] Unable to admit torrent (%s): %s", PLUGIN_NAME, id, e)
+      return "error: %s" % e
+
+  @timed
   def _update_loop(self):
 
     if not self.initialized:
       return
 
-    if self.active is None:
-      while self.queue:
-        id = self.queue.pop(0)
-        if id in self.torrents:
-          job = self.torrents[id]
-          if self.orig_move_storage(job.torrent, job.dest_path):
-            log.debug("[%s] Moving (%s)", PLUGIN_NAME, id)
-            job.start(self.config["general"]["estimated_speed"])
-            self.active = id
-            break
+    self._update_load()
 
-          self._report_result(id, "error", "Error", "General failure")
+    if self.leases:
+      self.leases.heartbeat()
 
-        self.active = None
+    if self.active is None and self.queue:
+      # Devices without a free lease are only tried once per update
+      busy = set()
+      for id in self.queue[:]:
+        if id not in self.torrents:
+          self.queue.remove(id)
+          continue
+
+        job = self.torrents[id]
+        reason = self._get_deferral(job) or self._acquire_lease(job, busy)
+        self._set_deferral(job, reason)
+        if reason:
+          continue
 
-    if self.active:
-      self.torrents[self.active].update()
+        self.queue.remove(id)
+        if job.dedup_matches and job.cross_device:
+          self._materialize(id, job)
+          break
+
+        if self._start_move(id, job):
+          break
+    else:
+      # Deferred jobs that are now only waiting for the slot should not keep
+      # showing the old reason
+      for id in self.queue:
+        job = self.torrents.get(id)
+        if job and job.deferred:
+          self._set_deferral(job, self._get_deferral(job))
+
+    job = self.torrents.get(self.active)
+    if job and job.status == "Moving":
+      start = time.time()
+      job.update()
+      self.tracer.complete("update", None, start)
 
     reactor.callLater(UPDATE_INTERVAL, self._update_loop)
 
+  def _update_load(self):
+    limits = self.config["scheduling"]
+    if not (limits["max_upload_rate"] or limits["max_disk_read_rate"] or
+        limits["max_disk_write_rate"]):
+      return
+
+    core = component.get("Core")
+    status = core.get_session_status(["upload_rate"])
+    cache = core.get_cache_status()
+    self.load.update(status["upload_rate"], cache["blocks_read"],
+      cache["blocks_written"])
+
+  def _start_move(self, id, job):
+    workers = self._get_transfer_workers(job)
+    if workers:
+      self._start_transfer(id, job, workers)
+      return True
+
+    start = time.time()
+    result = self.orig_move_storage(job.torrent, job.dest_path)
+    self.tracer.complete("waiting", id, job.queued_time, start)
+    self.tracer.complete("orig_move_storage", id, start)
+
+    if result:
+      log.debug("[%s] Moving (%s)", PLUGIN_NAME, id)
+      job.start(self.config["general"]["estimated_speed"])
+      self.active = id
+      return True
+
+    self.active = None
+    self._restore_staged(id, job)
+    self._report_result(id, "error", "Error", "General failure")
+    return False
+
+  def _get_deferral(self, job):
+    if job.restoring:
+      return "restoring files"
+
+    if job.devices is None:
+      job.devices = (get_device(job.src_path), get_device(job.dest_path))
+      job.cross_device = job.devices[0] != job.devices[1]
+
+    if not job.cross_device:
+      return None
+
+    limits = self.config["scheduling"]
+
+    if self.windows and job.total_size >= limits["large_job_size"]:
+      if not in_windows(self.windows):
+        return "waiting for %s" % ", ".join(w[0] for w in self.windows)
+
+    if job.total_size >= limits["small_job_size"]:
+      overload = self.load.get_overload(limits)
+      if overload:
+        return "waiting for load (%s)" % overload
+
+    return None
+
+  def _set_deferral(self, job, reason):
+    if reason:
+      job.message = "Queued: %s" % reason
+    elif job.deferred:
+      job.message = "Queued: retry %d" % job.retries if job.retries \
+        else "Queued"
+
+    job.deferred = bool(reason)
+
+  def _setup_coordination(self):
+    # Leases of moving jobs are kept until the jobs end so that reloading
+    # the settings does not let another move take their slot
+    held = [job.lease for job in self.torrents.itervalues() if job.lease]
+
+    if self.leases:
+      for lease in self.leases.leases[:]:
+        if lease not in held:
+          self.leases.release(lease)
+      self.leases = None
+
+    options = self.config["coordination"]
+    if not options["enabled"] or not options["lock_dir"]:
+      return
+
+    try:
+      self.leases = LeaseManager(options["lock_dir"],
+        options["max_per_device"], options["heartbeat"],
+        options["stale_timeout"])
+    except (RuntimeError, OSError) as e:
+      log.error("[%s] Unable to set up coordination: %s", PLUGIN_NAME, e)
+      return
+
+    for lease in held:
+      self.leases.adopt(lease)
+
+  def _acquire_lease(self, job, busy):
+    if not self.leases or not job.cross_device or job.lease:
+      return None
+
+    device = job.devices[1]
+    if device is None:
+      return None
+
+    if device not in busy:
+      job.lease = self.leases.acquire(device)
+
+    if not job.lease:
+      busy.add(device)
+      return "waiting for device lease"
+
+    return None
+
+  def _release_lease(self, job):
+    if job.lease:
+      if self.leases:
+        self.leases.release(job.lease)
+      else:
+        job.lease.release()
+      job.lease = None
+
+  def _index_job(self, id):
+    options = self.config["dedup"]
+    if not options["enabled"]:
+      return
+
+    job = self.torrents[id]
+    job.dedup_matches = self.dedup_index.find(id, job.dest_path, job.files,
+      options["min_file_size"])
+    self.dedup_index.add(id, job.dest_path, job.files,
+      options["min_file_size"])
+
+    if job.dedup_matches:
+      log.debug("[%s] Found %d duplicate files (%s)", PLUGIN_NAME,
+        len(job.dedup_matches), id)
+
+  def _materialize(self, id, job):
+    # The slot is held while linking so that no other move starts
+    self.active = id
+    job.message = "Queued: linking duplicates"
+
+    # Verifying samples of many files on a slow device would block the
+    # reactor, so the files are linked in a thread
+    start = time.time()
+    d = deferToThread(materialize, job.src_path, job.dest_path, job.files,
+      job.dedup_matches, self.config["dedup"],
+      get_stage_path(job.src_path, id))
+    d.addErrback(self._on_link_failed, id)
+    d.addCallback(self._on_linked, id, job, start)
+
+  def _on_link_failed(self, failure, id):
+    log.warning("[%s] Unable to link duplicates (%s): %s", PLUGIN_NAME, id,
+      failure.getErrorMessage())
+    return []
+
+  @timed
+  def _on_linked(self, linked, id, job, start):
+    job.dedup_matches = ()
+    for i, created in linked:
+      path, size = job.files[i]
+      job.staged.append(path)
+      job.linked_size += size
+      if created:
+        job.created.append(path)
+
+    self.tracer.complete("link", id, start,
+      args={"bytes": job.linked_size})
+    if linked:
+      log.debug("[%s] Linked %d bytes at destination", PLUGIN_NAME,
+        job.linked_size)
+
+    if self.torrents.get(id) is not job or not self.initialized:
+      self._restore_staged(id, job)
+      if self.active == id:
+        self.active = None
+      return
+
+    job.message = "Queued"
+    self._start_move(id, job)
+
+  def _restore_staged(self, id, job):
+    if not (job.staged or job.created):
+      return
+
+    # The torrent still points at the source, so the files set aside are
+    # put back and the files made at the destination are removed
+    staged, job.staged = job.staged, []
+    created, job.created = job.created, []
+    job.linked_size = 0
+    job.restoring = True
+
+    def on_restored(result):
+      job.restoring = False
+      return result
+
+    d = deferToThread(restore_staged, job.src_path, job.dest_path,
+      get_stage_path(job.src_path, id), staged, created)
+    d.addBoth(on_restored)
+    d.addErrback(self._on_stage_error, id)
+
+  def _discard_staged(self, id, job):
+    job.created = []
+    if not job.staged:
+      return succeed(None)
+
+    staged, job.staged = job.staged, []
+    d = deferToThread(discard_files, get_stage_path(job.src_path, id), staged)
+    d.addErrback(self._on_stage_error, id)
+    return d
+
+  def _remove_empty(self, result, path):
+    try:
+      log.debug("[%s] Removing empty folders in path: %s", PLUGIN_NAME, path)
+      os.removedirs(path)
+    except OSError:
+      pass
+
+  def _on_stage_error(self, failure, id):
+    log.warning("[%s] Unable to clean up files set aside (%s): %s",
+      PLUGIN_NAME, id, failure.getErrorMessage())
+
+  def _trace_end(self, id, alert, args=None):
+    job = self.torrents[id]
+    if job._start_time is not None:
+      self.tracer.complete("moving", id, job._start_time)
+
+    self.tracer.instant(alert, id, args)
+
+  def _get_trace_path(self):
+    return self.config["recorder"]["path"] or \
+      deluge.configmanager.get_config_dir(TRACE_FILE)
+
+  def _record_job(self, id, result):
+    job = self.torrents[id]
+    if job._start_time is None:
+      return
+
+    self.recorder.record({
+      "id": id,
+      "time": job.queued_time,
+      "start": job._start_time,
+      "end": job._end_time or time.time(),
+      "size": job.total_size,
+      "files": len(job.files),
+      "src_dev": job.devices[0] if job.devices else None,
+      "dest_dev": job.devices[1] if job.devices else None,
+      "result": result,
+    })
+
+  @timed
+  def _tiering_loop(self):
+    if not self.initialized:
+      return
+
+    options = self.config["tiering"]
+    if options["enabled"] and options["fast_path"] and options["slow_path"]:
+      statuses = component.get("Core").get_torrents_status({}, TIERING_KEYS)
+      self.tiering.sample(statuses)
+
+      moves = dict(self.tiering.select(statuses))
+      if moves:
+        log.debug("[%s] Tiering %d torrents", PLUGIN_NAME, len(moves))
+
+        # Only moves that are queued count towards the daily budget
+        def admit(torrent):
+          id = torrent.torrent_id
+          result = self._queue_job(torrent, moves[id])
+          if result == "queued":
+            self.tiering.reset(id)
+            self.tiering.charge(statuses[id]["total_size"])
+          return result
+
+        self._admit(moves.keys(), admit)
+
+    self.tiering_call = reactor.callLater(options["sample_interval"],
+      self._tiering_loop)
+
+  def _get_transfer_workers(self, job):
+    options = self.config["transfer"]
+    if not options["enabled"] or not job.cross_device:
+      return 0
+
+    # Pieces written after a file was copied would be lost, so torrents
+    # that are still downloading are left to libtorrent
+    if not job.torrent.handle.is_finished():
+      return 0
+
+    if len(job.files) < options["min_files"]:
+      return 0
+
+    for path, workers in options["device_workers"].iteritems():
+      if get_device(path) == job.devices[1]:
+        return workers
+
+    return options["workers"]
+
+  def _start_transfer(self, id, job, workers):
+    log.debug("[%s] Transferring with %d workers (%s)", PLUGIN_NAME, workers,
+      id)
+
+    job.start(self.config["general"]["estimated_speed"])
+    self.active = id
+
+    # Linked files are already at the destination and their sources are
+    # set aside
+    staged = set(job.staged)
+    files = [f for f in job.files if f[0] not in staged]
+
+    job.transfer = ParallelTransfer(job.src_path, job.dest_path, files,
+      workers, self.config["transfer"]["large_file_size"],
+      get_stage_path(job.src_path, id))
+
+    start = time.time()
+    d = job.transfer.start()
+    d.addCallbacks(self._on_transfer_done, self._on_transfer_failed,
+      callbackArgs=(id, job, start), errbackArgs=(id, job, start))
+
+  @timed
+  def _on_transfer_done(self, result, id, job, start):
+    self.tracer.complete("transfer", id, start)
+    job.staged.extend(job.transfer.staged)
+    job.created.extend(job.transfer.created)
+
+    if self.torrents.get(id) is not job or not self.initialized:
+      self._restore_staged(id, job)
+      return
+
+    if not self.orig_move_storage(job.torrent, job.dest_path):
+      self.active = None
+      self._restore_staged(id, job)
+      self._report_result(id, "error", "Error", "General failure")
+
+  @timed
+  def _on_transfer_failed(self, failure, id, job, start):
+    self.tracer.complete("transfer", id, start)
+    job.staged.extend(job.transfer.staged)
+    job.created.extend(job.transfer.created)
+    job.transfer = None
+
+    if self.torrents.get(id) is not job or not self.initialized:
+      self._restore_staged(id, job)
+      return
+
+    self.active = None
+    error = failure.value
+    message = getattr(error, "strerror", None) or str(error)
+    self._fail_job(id, message, getattr(error, "errno", None))
+
+  def _fail_job(self, id, message, code=None):
+    job = self.torrents[id]
+    options = self.config["retry"]
+
+    self._restore_staged(id, job)
+
+    error_type = classify_error(message, code)
+    log.debug("[%s] Move failed (%s): %s (%s, errno %s)", PLUGIN_NAME, id,
+      message, error_type, code)
+
+    if error_type == "permanent" or job.retries >= options["max_retries"]:
+      if job.retries:
+        message = "%s (after %d retries)" % (message, job.retries)
+      self._report_result(id, "error", "Error", message)
+      return
+
+    job.retries += 1
+    delay = get_retry_delay(job.retries, options["base_delay"],
+      options["max_delay"])
+
+    job.status = "Queued"
+    job.message = "Queued: retry %d/%d in %d s (%s)" % (job.retries,
+      options["max_retries"], delay, message)
+    log.debug("[%s] %s (%s)", PLUGIN_NAME, job.message, id)
+
+    self._release_lease(job)
+    self.tracer.instant("retry", id, {"delay": delay, "message": message})
+
+    # The job waits outside of the queue so that it does not hold up others
+    self._cancel_retry(id)
+    self.retry_calls[id] = reactor.callLater(delay, self._requeue, id)
+
+  @timed
+  def _requeue(self, id):
+    self.retry_calls.pop(id, None)
+    if id in self.torrents and self.torrents[id].status == "Queued":
+      job = self.torrents[id]
+      job.message = "Queued: retry %d" % job.retries
+      self.queue.append(id)
+
+  def _cancel_retry(self, id):
+    if id in self.retry_calls:
+      if self.retry_calls[id].active():
+        self.retry_calls[id].cancel()
+      del self.retry_calls[id]
+
   def _report_result(self, id, type, status, message=""):
     if id in self.torrents:
       if message:
@@ -403,23 +1341,49 @@ class Core(CorePluginBase):
         message = status
 
       log.debug("[%s] Status (%s): %s", PLUGIN_NAME, id, message)
+      if type == "error":
+        self.dedup_index.remove(id)
+
+      if self.config["recorder"]["enabled"]:
+        self._record_job(id, type)
+
+      self._release_lease(self.torrents[id])
+
       self.torrents[id].status = status
       self.torrents[id].message = message
       self._schedule_remove(id, self.timeout.get(type, 0))
 
+  @timed
+  def _expire_job(self, id):
+    # Results of moves that a client is watching are kept until the client
+    # has been given them, or until it has likely gone away
+    if id in self.watched:
+      self.expired.add(id)
+      self.calls[id] = reactor.callLater(WATCH_TIMEOUT, self._remove_job, id)
+      return
+
+    self._remove_job(id)
+
   def _remove_job(self, id):
     self._cancel_remove(id)
+    self._cancel_retry(id)
+    self.watched.discard(id)
+    self.expired.discard(id)
 
     if id in self.queue:
       self.queue.remove(id)
 
     if id in self.torrents:
+      if self.torrents[id].status in ALIVE_STATUS:
+        self.dedup_index.remove(id)
+        self._release_lease(self.torrents[id])
+
       del self.torrents[id]
 
   def _schedule_remove(self, id, time):
     self._cancel_remove(id)
     if time >= 0:
-      self.calls[id] = reactor.callLater(time, self._remove_job, id)
+      self.calls[id] = reactor.callLater(time, self._expire_job, id)
 
   def _cancel_remove(self, id):
     if id in self.calls:
@@ -0,0 +1,198 @@
+#
+# dedup.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import os
+import os.path
+import errno
+import hashlib
+import logging
+
+from collections import OrderedDict
+
+from common import PLUGIN_NAME
+from common import stage_files
+
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+
+log = logging.getLogger(__name__)
+
+
+def strip_root(path):
+  # Cross-seeded torrents often differ only in the name of the root folder
+  return path.replace("\\", "/").partition("/")[2] or path
+
+
+def get_sample_digest(path, size, count, length):
+  digest = hashlib.sha1()
+  with open(path, "rb") as f:
+    if size <= count*length:
+      digest.update(f.read())
+    else:
+      step = (size - length) // max(count - 1, 1)
+      for i in range(count):
+        f.seek(i*step)
+        digest.update(f.read(length))
+
+  return digest.digest()
+
+
+def clone_file(src, dest):
+  import fcntl
+
+  with open(src, "rb") as f_src:
+    with open(dest, "wb") as f_dest:
+      try:
+        fcntl.ioctl(f_dest.fileno(), FICLONE, f_src.fileno())
+      except IOError:
+        f_dest.close()
+        os.remove(dest)
+        raise
+
+
+def link_file(src, dest, mode):
+  parent = os.path.dirname(dest)
+  if not os.path.isdir(parent):
+    os.makedirs(parent)
+
+  if mode == "reflink":
+    try:
+      clone_file(src, dest)
+      return "reflink"
+    except (IOError, OSError, ImportError) as e:
+      log.debug("[%s] Reflink failed, using hardlink: %s", PLUGIN_NAME, e)
+
+  os.link(src, dest)
+  return "hardlink"
+
+
+class DedupIndex(object):
+
+  def __init__(self, history):
+    self.history = history
+    self._files = {}
+    self._jobs = OrderedDict()
+
+  def _get_key(self, dest_path, path, size):
+    return (os.path.normpath(dest_path), strip_root(path), size)
+
+  def add(self, id, dest_path, files, min_size=1):
+    self.remove(id)
+
+    keys = []
+    for path, size in files:
+      if size < min_size:
+        continue
+
+      key = self._get_key(dest_path, path, size)
+      if key not in self._files:
+        self._files[key] = (id, os.path.join(dest_path, path))
+        keys.append(key)
+
+    self._jobs[id] = keys
+
+    while len(self._jobs) > self.history:
+      self.remove(next(iter(self._jobs)))
+
+  def remove(self, id):
+    for key in self._jobs.pop(id, ()):
+      if self._files.get(key, (None,))[0] == id:
+        del self._files[key]
+
+  def find(self, id, dest_path, files, min_size=1):
+    matches = []
+    for i, (path, size) in enumerate(files):
+      if size < min_size:
+        continue
+
+      key = self._get_key(dest_path, path, size)
+      if key in self._files and self._files[key][0] != id:
+        matches.append((i, self._files[key][1]))
+
+    return matches
+
+
+def materialize(src_path, dest_path, files, matches, options, stage_path):
+  linked = []
+  for i, existing in matches:
+    path, size = files[i]
+    src = os.path.join(src_path, path)
+    dest = os.path.join(dest_path, path)
+
+    try:
+      if not os.path.isfile(src) or os.path.getsize(existing) != size:
+        continue
+
+      if options["verify"]:
+        args = (size, options["sample_count"], options["sample_size"])
+        if get_sample_digest(src, *args) != \
+            get_sample_digest(existing, *args):
+          log.debug("[%s] Sample mismatch: %s", PLUGIN_NAME, existing)
+          continue
+
+      created = dest != existing
+      if created:
+        if os.path.lexists(dest):
+          continue
+
+        mode = link_file(existing, dest, options["link_mode"])
+        log.debug("[%s] Linked (%s): %s -> %s", PLUGIN_NAME, mode, existing,
+          dest)
+
+      # The data is already at the destination, so the source copy is set
+      # aside to keep libtorrent from copying it again. It is only removed
+      # once the move succeeds.
+      try:
+        stage_files(src_path, stage_path, (path,))
+      except OSError:
+        # A link left next to the source copy would be overwritten in place
+        if created:
+          os.remove(dest)
+        raise
+
+      linked.append((i, created))
+    except (IOError, OSError) as e:
+      if e.errno != errno.ENOENT:
+        log.warning("[%s] Unable to link %s: %s", PLUGIN_NAME, dest, e)
+
+  return linked
+
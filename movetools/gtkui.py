@@ -143,7 +143,8 @@ class GtkUI(GtkPluginBase):
       },
     }
 
-    if not dict_equals(config, self.config):
+    current = dict((k, self.config.get(k)) for k in config)
+    if not dict_equals(config, current):
       client.movetools.set_settings(config)
     else:
       log.debug("[%s] No settings were changed", PLUGIN_NAME)
@@ -247,7 +248,7 @@ class GtkUI(GtkPluginBase):
           value = float(status.split()[-1])
           cell.set_property("value", value)
 
-          status = "%s %.2f%%" % (_("Moving"), value)
+          status = "%s %.2f%%" % (_(status.rsplit(" ", 1)[0]), value)
         except ValueError:
           status = _("Status error")
 
@@ -0,0 +1,209 @@
+#
+# lease.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import os
+import os.path
+import time
+import errno
+import socket
+import logging
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+from common import PLUGIN_NAME
+
+
+log = logging.getLogger(__name__)
+
+
+class Lease(object):
+
+  def __init__(self, device, path, fd):
+    self.device = device
+    self.path = path
+    self.fd = fd
+    self.inode = os.fstat(fd).st_ino
+
+  def is_valid(self):
+    try:
+      return os.stat(self.path).st_ino == self.inode
+    except OSError:
+      return False
+
+  def touch(self):
+    os.ftruncate(self.fd, 0)
+    os.lseek(self.fd, 0, os.SEEK_SET)
+    os.write(self.fd, "%s %d %f\n" % (socket.gethostname(), os.getpid(),
+      time.time()))
+    os.utime(self.path, None)
+
+  def release(self):
+    if self.is_valid():
+      try:
+        os.unlink(self.path)
+      except OSError:
+        pass
+
+    self.close()
+
+  def close(self):
+    # The descriptor number may be reused once closed, so it is only
+    # closed once
+    if self.fd is None:
+      return
+
+    try:
+      os.close(self.fd)
+    except OSError:
+      pass
+    self.fd = None
+
+
+class LeaseManager(object):
+
+  def __init__(self, lock_dir, max_per_device, heartbeat, stale_timeout):
+    if fcntl is None:
+      raise RuntimeError("File locking is not supported on this platform")
+
+    self.lock_dir = lock_dir
+    self.max_per_device = max(int(max_per_device), 1)
+    self.heartbeat_interval = heartbeat
+    self.stale_timeout = stale_timeout
+
+    self.leases = []
+    self._last_heartbeat = 0
+
+    if not os.path.isdir(lock_dir):
+      os.makedirs(lock_dir)
+
+  def _get_path(self, device, slot):
+    return os.path.join(self.lock_dir, "%s.%d.lock" % (device, slot))
+
+  def _try_lock(self, device, path):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+    try:
+      fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+      os.close(fd)
+      if e.errno not in (errno.EAGAIN, errno.EACCES):
+        raise
+      return None
+
+    lease = Lease(device, path, fd)
+
+    # The file may have been taken over and unlinked after it was opened
+    if not lease.is_valid():
+      lease.close()
+      return None
+
+    lease.touch()
+    return lease
+
+  def _take_over(self, path):
+    try:
+      age = time.time() - os.stat(path).st_mtime
+    except OSError:
+      return False
+
+    if age < self.stale_timeout:
+      return False
+
+    log.warning("[%s] Taking over stale lease: %s (%d s old)", PLUGIN_NAME,
+      path, age)
+    try:
+      os.unlink(path)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+
+    return True
+
+  def acquire(self, device):
+    for slot in range(self.max_per_device):
+      path = self._get_path(device, slot)
+      try:
+        lease = self._try_lock(device, path)
+        if not lease and self._take_over(path):
+          lease = self._try_lock(device, path)
+      except (IOError, OSError) as e:
+        log.warning("[%s] Unable to acquire lease %s: %s", PLUGIN_NAME,
+          path, e)
+        continue
+
+      if lease:
+        log.debug("[%s] Acquired lease: %s", PLUGIN_NAME, path)
+        self.leases.append(lease)
+        return lease
+
+    return None
+
+  def release(self, lease):
+    if lease in self.leases:
+      self.leases.remove(lease)
+
+    log.debug("[%s] Releasing lease: %s", PLUGIN_NAME, lease.path)
+    lease.release()
+
+  def adopt(self, lease):
+    if lease not in self.leases:
+      self.leases.append(lease)
+
+  def release_all(self):
+    for lease in self.leases[:]:
+      self.release(lease)
+
+  def heartbeat(self):
+    now = time.time()
+    if now - self._last_heartbeat < self.heartbeat_interval:
+      return
+
+    self._last_heartbeat = now
+    for lease in self.leases:
+      if lease.is_valid():
+        try:
+          lease.touch()
+        except (IOError, OSError) as e:
+          log.warning("[%s] Unable to renew lease %s: %s", PLUGIN_NAME,
+            lease.path, e)
+      else:
+        log.warning("[%s] Lease was taken over: %s", PLUGIN_NAME, lease.path)
@@ -0,0 +1,73 @@
+#
+# recorder.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import json
+import logging
+
+from common import PLUGIN_NAME
+
+
+log = logging.getLogger(__name__)
+
+
+class TraceRecorder(object):
+
+  def __init__(self, path):
+    self.path = path
+
+  def record(self, entry):
+    try:
+      with open(self.path, "a") as f:
+        f.write(json.dumps(entry, sort_keys=True))
+        f.write("\n")
+    except IOError as e:
+      log.warning("[%s] Unable to write trace: %s", PLUGIN_NAME, e)
+
+
+def load_trace(path):
+  entries = []
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if line:
+        entries.append(json.loads(line))
+
+  entries.sort(key=lambda e: e["time"])
+  return entries
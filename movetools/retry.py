@@ -0,0 +1,100 @@
+#
+# retry.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import errno
+import random
+
+
+def _get_errnos(*names):
+  return frozenset(getattr(errno, name) for name in names
+    if hasattr(errno, name))
+
+
+PERMANENT_ERRNOS = _get_errnos("ENOENT", "ENOSPC", "EDQUOT", "EACCES",
+  "EPERM", "EROFS", "ENAMETOOLONG", "ENOTDIR", "EISDIR", "EFBIG")
+
+TRANSIENT_ERRNOS = _get_errnos("EBUSY", "EAGAIN", "EINTR", "EIO",
+  "ETIMEDOUT", "ESTALE", "ETXTBSY", "ENETDOWN", "ENETUNREACH",
+  "ENETRESET", "ECONNRESET", "ECONNABORTED", "ECONNREFUSED", "EHOSTDOWN",
+  "EHOSTUNREACH", "ENOLCK", "ENOMEM")
+
+PERMANENT_MESSAGES = ("no such file", "no space", "quota",
+  "permission denied", "not permitted", "read-only", "name too long",
+  "not a directory", "is a directory", "file too large")
+
+TRANSIENT_MESSAGES = ("busy", "temporarily unavailable", "try again",
+  "interrupted", "input/output", "timed out", "stale", "network", "host",
+  "connection", "no locks")
+
+
+def get_error_code(alert):
+  error = getattr(alert, "error", None)
+  if error is None:
+    return None
+
+  try:
+    if error.category().name() not in ("system", "generic"):
+      return None
+    return error.value()
+  except (AttributeError, TypeError):
+    return None
+
+
+def classify_error(message, code=None):
+  if code in PERMANENT_ERRNOS:
+    return "permanent"
+  if code in TRANSIENT_ERRNOS:
+    return "transient"
+
+  message = message.lower()
+  for text in PERMANENT_MESSAGES:
+    if text in message:
+      return "permanent"
+  for text in TRANSIENT_MESSAGES:
+    if text in message:
+      return "transient"
+
+  # Unknown errors are retried since a failed retry costs little
+  return "transient"
+
+
+def get_retry_delay(retries, base_delay, max_delay):
+  delay = min(base_delay * 2**(retries-1), max_delay)
+  return delay/2 + random.uniform(0, delay/2)
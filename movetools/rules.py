@@ -0,0 +1,165 @@
+#
+# rules.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import os
+import os.path
+import logging
+
+from common import PLUGIN_NAME
+from common import get_existing_path
+
+
+log = logging.getLogger(__name__)
+
+
+def get_free_space(path):
+  try:
+    stat = os.statvfs(get_existing_path(path))
+  except (AttributeError, OSError):
+    return None
+
+  return stat.f_bavail * stat.f_frsize
+
+
+def get_extension(path):
+  return os.path.splitext(path)[1].lower()
+
+
+class Rule(object):
+
+  def __init__(self, index, spec):
+    self.index = index
+    self.name = spec.get("name") or "Rule %d" % (index+1)
+
+    self.dest_path = spec["dest_path"]
+    if not self.dest_path:
+      raise ValueError("Empty destination path")
+
+    self.labels = frozenset(l.lower() for l in spec.get("labels", ()))
+    self.trackers = tuple(t.lower() for t in spec.get("trackers", ()))
+
+    self.min_size = int(spec.get("min_size", 0))
+    self.max_size = int(spec.get("max_size", 0))
+
+    self.extensions = frozenset(
+      e.lower() if e.startswith(".") else ".%s" % e.lower()
+      for e in spec.get("extensions", ()))
+    self.extension_ratio = float(spec.get("extension_ratio", 0.5))
+
+    self.min_free_space = int(spec.get("min_free_space", 0))
+
+  def matches(self, info, get_free_space):
+    if self.trackers:
+      tracker = info["tracker"]
+      for pattern in self.trackers:
+        if pattern in tracker:
+          break
+      else:
+        return False
+
+    size = info["size"]
+    if size < self.min_size:
+      return False
+    if self.max_size and size > self.max_size:
+      return False
+
+    if self.extensions:
+      matched = sum(v for k, v in info["extensions"].iteritems()
+        if k in self.extensions)
+      if float(matched) / (size or 1) < self.extension_ratio:
+        return False
+
+    # Free space is checked last since it touches the filesystem
+    if self.min_free_space:
+      free = get_free_space(self.dest_path)
+      if free is None or free - size < self.min_free_space:
+        return False
+
+    return True
+
+  def to_dict(self):
+    return {
+      "index": self.index,
+      "name": self.name,
+      "dest_path": self.dest_path,
+    }
+
+
+class RuleMatcher(object):
+
+  def __init__(self, specs):
+    rules = []
+    for i, spec in enumerate(specs):
+      if not spec.get("enabled", True):
+        continue
+
+      try:
+        rules.append(Rule(i, spec))
+      except (KeyError, TypeError, ValueError) as e:
+        log.warning("[%s] Ignoring invalid rule %d: %s", PLUGIN_NAME, i+1, e)
+
+    self.rules = tuple(rules)
+
+    # Rules are indexed by label so that a lookup only visits rules that
+    # can possibly apply, already in rule order
+    self._any_label = tuple(r for r in rules if not r.labels)
+
+    labels = set()
+    for rule in rules:
+      labels.update(rule.labels)
+
+    self._by_label = {}
+    for label in labels:
+      self._by_label[label] = tuple(r for r in rules
+        if not r.labels or label in r.labels)
+
+    self.needs_label = bool(labels)
+    self.needs_tracker = any(r.trackers for r in rules)
+    self.needs_extensions = any(r.extensions for r in rules)
+
+  def __len__(self):
+    return len(self.rules)
+
+  def match(self, info, get_free_space=get_free_space):
+    for rule in self._by_label.get(info["label"], self._any_label):
+      if rule.matches(info, get_free_space):
+        return rule
+
+    return None
@@ -0,0 +1,130 @@
+#
+# scheduling.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import time
+import logging
+
+from common import PLUGIN_NAME
+
+
+DISK_BLOCK_SIZE = 16*2**10
+
+
+log = logging.getLogger(__name__)
+
+
+def parse_time(text):
+  hours, minutes = text.strip().split(":")
+  hours = int(hours)
+  minutes = int(minutes)
+  if not (0 <= hours <= 24 and 0 <= minutes < 60):
+    raise ValueError("Invalid time: %s" % text)
+
+  return hours*60 + minutes
+
+
+def parse_windows(specs):
+  windows = []
+  for spec in specs:
+    try:
+      start, end = spec.split("-")
+      windows.append((spec.strip(), parse_time(start), parse_time(end)))
+    except ValueError as e:
+      log.warning("[%s] Ignoring invalid time window %r: %s", PLUGIN_NAME,
+        spec, e)
+
+  return tuple(windows)
+
+
+def in_windows(windows, now=None):
+  local = time.localtime(now)
+  minute = local.tm_hour*60 + local.tm_min
+
+  for spec, start, end in windows:
+    if start <= end:
+      if start <= minute < end:
+        return True
+    elif minute >= start or minute < end:
+      # Window wraps around midnight
+      return True
+
+  return False
+
+
+def format_rate(rate):
+  return "%.1f MiB/s" % (float(rate) / 2**20)
+
+
+class LoadMonitor(object):
+
+  def __init__(self):
+    self._last = None
+
+    self.upload_rate = 0.0
+    self.disk_read_rate = 0.0
+    self.disk_write_rate = 0.0
+
+  def update(self, upload_rate, blocks_read, blocks_written, now=None):
+    now = time.time() if now is None else now
+    self.upload_rate = upload_rate
+
+    if self._last:
+      last_time, last_read, last_written = self._last
+      elapsed = now - last_time
+      if elapsed > 0:
+        self.disk_read_rate = \
+          max(blocks_read - last_read, 0) * DISK_BLOCK_SIZE / elapsed
+        self.disk_write_rate = \
+          max(blocks_written - last_written, 0) * DISK_BLOCK_SIZE / elapsed
+
+    self._last = (now, blocks_read, blocks_written)
+
+  def get_overload(self, limits):
+    checks = (
+      ("upload", self.upload_rate, limits["max_upload_rate"]),
+      ("disk read", self.disk_read_rate, limits["max_disk_read_rate"]),
+      ("disk write", self.disk_write_rate, limits["max_disk_write_rate"]),
+    )
+
+    for name, rate, limit in checks:
+      if limit and rate > limit:
+        return "%s %s" % (name, format_rate(rate))
+
+    return None
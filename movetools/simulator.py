@@ -0,0 +1,542 @@
+#
+# simulator.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import logging
+import optparse
+import tempfile
+import __builtin__
+
+if "_" not in __builtin__.__dict__:
+  import gettext
+  gettext.install("deluge")
+
+from twisted.internet.task import Clock
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import maybeDeferred
+
+import deluge.component as component
+import deluge.configmanager
+
+import core
+import scheduling
+import tracing
+import stalls
+from common import PLUGIN_NAME
+from recorder import load_trace
+from transfer import TransferStopped
+
+
+DEFAULT_RATE = 100*2**20
+DEFAULT_FILE_LATENCY = 0.005
+RENAME_TIME = 0.05
+
+
+log = logging.getLogger(__name__)
+
+
+class VirtualClock(Clock):
+
+  def time(self):
+    return self.seconds()
+
+  def localtime(self, secs=None):
+    return time.localtime(self.seconds() if secs is None else secs)
+
+
+class SimHandle(object):
+
+  def __init__(self, id):
+    self.id = id
+
+  def info_hash(self):
+    return self.id
+
+  def is_finished(self):
+    return True
+
+
+class SimAlert(object):
+
+  def __init__(self, handle, message=""):
+    self.handle = handle
+    self._message = message
+
+  def message(self):
+    return self._message
+
+
+class SimJob(object):
+
+  def __init__(self, entry, index):
+    self.id = "%040x" % index
+    self.arrival = entry["time"]
+    self.size = int(entry["size"])
+    self.file_count = max(int(entry.get("files", 1)), 1)
+    self.src_dev = str(entry.get("src_dev"))
+    self.dest_dev = str(entry.get("dest_dev"))
+
+    self.src_path = "/%s/src/%s" % (self.src_dev, self.id)
+    self.dest_path = "/%s/dest/%s" % (self.dest_dev, self.id)
+
+    file_size = self.size // self.file_count
+    self.files = [{"path": "f%d" % i, "size": file_size}
+      for i in range(self.file_count)]
+    self.files[-1]["size"] += self.size - file_size*self.file_count
+
+    self.start = None
+    self.end = None
+    self.rate = None
+    self.duration = None
+    self.moved = False
+    self.transferred = False
+
+  def get_copied(self, now):
+    if self.start is None:
+      return 0
+    if now >= self.start + self.duration:
+      return self.size
+
+    return int(self.size * (now - self.start) / self.duration)
+
+
+class SimTorrent(object):
+
+  simulator = None
+
+  def __init__(self, job):
+    self.job = job
+    self.torrent_id = job.id
+    self.handle = SimHandle(job.id)
+    self.options = {
+      "move_completed": False,
+      "move_completed_path": job.dest_path,
+    }
+
+  def get_status(self, keys):
+    save_path = self.job.dest_path if self.job.moved else self.job.src_path
+    return {"save_path": save_path}
+
+  def get_files(self):
+    return self.job.files
+
+  def move_storage(self, dest_path):
+    return self.simulator.move_storage(self, dest_path)
+
+
+class SimTransfer(object):
+
+  simulator = None
+
+  def __init__(self, src_path, dest_path, files, workers, large_file_size,
+      stage_path):
+    self.job = self.simulator.sources[src_path]
+    self.files = files
+    self.workers = max(int(workers), 1)
+    self.size = sum(size for path, size in files)
+
+    self.created = []
+    self.staged = []
+    self._deferred = None
+    self._call = None
+
+  @property
+  def copied(self):
+    job = self.job
+    return min(job.get_copied(self.simulator.clock.seconds()), self.size)
+
+  def start(self):
+    sim = self.simulator
+    job = self.job
+
+    # Workers share the per file overhead, but not the device throughput
+    job.start = sim.clock.seconds()
+    job.rate = sim.get_rate(job)
+    job.duration = float(self.size) / job.rate + \
+      len(self.files) * sim.file_latency / self.workers
+
+    self._deferred = Deferred()
+    self._call = sim.clock.callLater(job.duration, self._on_copied)
+    return self._deferred
+
+  def stop(self):
+    if self._call and self._call.active():
+      self._call.cancel()
+      self._deferred.errback(TransferStopped())
+
+  def _on_copied(self):
+    self.job.transferred = True
+    self.created = [path for path, size in self.files]
+    self.staged = list(self.created)
+    self._deferred.callback(None)
+
+
+class SimEventManager(object):
+
+  def register_event_handler(self, event, handler):
+    pass
+
+  def deregister_event_handler(self, event, handler):
+    pass
+
+
+class SimAlertManager(object):
+
+  def __init__(self):
+    self.handlers = {}
+
+  def register_handler(self, alert_type, handler):
+    self.handlers[alert_type] = handler
+
+  def deregister_handler(self, handler):
+    pass
+
+
+class SimCorePluginManager(object):
+
+  def register_status_field(self, field, func):
+    pass
+
+  def deregister_status_field(self, field):
+    pass
+
+
+class SimFilterManager(object):
+
+  def register_tree_field(self, field, init_func=None):
+    pass
+
+  def deregister_tree_field(self, field):
+    pass
+
+
+class SimTorrentManager(object):
+
+  def __init__(self):
+    self.session_started = True
+    self.torrents = {}
+
+
+class SimCore(object):
+
+  def get_session_status(self, keys):
+    return dict((key, 0) for key in keys)
+
+  def get_cache_status(self):
+    return {"blocks_read": 0, "blocks_written": 0}
+
+  def get_torrent_status(self, id, keys):
+    return {}
+
+
+class SimRPCServer(object):
+
+  def __init__(self):
+    self.factory = self
+    self.methods = {}
+
+  def register_object(self, obj, name=None):
+    pass
+
+
+class Simulator(object):
+
+  def __init__(self, entries, rates, file_latency, settings=None,
+      preallocate=False):
+    self.clock = VirtualClock()
+    self.rates = rates
+    self.file_latency = file_latency
+    self.settings = settings or {}
+    self.preallocate = preallocate
+
+    # Arrival times are kept relative to the start of the trace, and the
+    # clock starts at the first arrival so that time windows still apply
+    self.start_time = entries[0]["time"] if entries else 0
+    self.jobs = [SimJob(dict(e, time=e["time"] - self.start_time), i)
+      for i, e in enumerate(entries)]
+    self.paths = {}
+    self.sources = dict((job.src_path, job) for job in self.jobs)
+    for job in self.jobs:
+      offset = 0
+      for f in job.files:
+        self.paths[job.src_path + "/" + f["path"]] = (job, f, offset, True)
+        self.paths[job.dest_path + "/" + f["path"]] = (job, f, offset, False)
+        offset += f["size"]
+
+    self.progress_errors = []
+    self.speed_errors = []
+    self.pending = len(self.jobs)
+
+  def get_rate(self, job):
+    default = self.rates.get(None, DEFAULT_RATE)
+    return min(self.rates.get(job.src_dev, default),
+      self.rates.get(job.dest_dev, default))
+
+  def get_device(self, path):
+    return path.split("/")[1] if path else None
+
+  def get_allocated_size(self, path):
+    if path not in self.paths:
+      return 0
+
+    job, f, offset, is_src = self.paths[path]
+    if is_src:
+      return 0 if job.moved else f["size"]
+
+    # Files are copied in order, so earlier files are complete
+    copied = job.get_copied(self.clock.seconds()) - offset
+    return min(max(copied, 0), f["size"])
+
+  def get_file_size(self, path):
+    if path not in self.paths:
+      return 0
+
+    job, f, offset, is_src = self.paths[path]
+    if not is_src and self.preallocate and job.start is not None:
+      return f["size"]
+
+    return self.get_allocated_size(path)
+
+  def move_storage(self, torrent, dest_path):
+    job = torrent.job
+    now = self.clock.seconds()
+
+    if job.transferred:
+      # Transferred files only need the save path of the torrent to change
+      job.rate = None
+      job.duration = now - job.start + RENAME_TIME
+    elif job.src_dev == job.dest_dev:
+      job.start = now
+      job.rate = None
+      job.duration = RENAME_TIME
+    else:
+      job.start = now
+      job.rate = self.get_rate(job)
+      job.duration = float(job.size) / job.rate + \
+        job.file_count * self.file_latency
+
+      estimated = self.core.config["general"]["estimated_speed"]
+      self.speed_errors.append(abs(estimated - job.rate) / float(job.rate))
+
+    self.clock.callLater(job.start + job.duration - now, self._on_moved, job)
+    return True
+
+  def _on_moved(self, job):
+    job.moved = True
+    job.end = self.clock.seconds()
+    self.pending -= 1
+
+    handler = self.alerts.handlers["storage_moved_alert"]
+    handler(SimAlert(SimHandle(job.id)))
+
+  def _on_arrival(self, job):
+    self.torrents.torrents[job.id] = torrent = SimTorrent(job)
+    if not torrent.move_storage(job.dest_path):
+      self.pending -= 1
+
+  def _sample_progress(self):
+    id = self.core.active
+    if id and id in self.core.torrents:
+      progress = self.core.torrents[id]
+      job = progress.torrent.job
+      if job.rate and progress.percent:
+        actual = float(job.get_copied(self.clock.seconds())) / job.size * 100
+        self.progress_errors.append(abs(progress.percent - actual))
+
+  def _setup(self):
+    self.clock.advance(self.start_time)
+
+    self.config_dir = tempfile.mkdtemp()
+    deluge.configmanager.set_config_dir(self.config_dir)
+
+    self.torrents = SimTorrentManager()
+    self.alerts = SimAlertManager()
+    for name, obj in (
+        ("TorrentManager", self.torrents),
+        ("AlertManager", self.alerts),
+        ("EventManager", SimEventManager()),
+        ("CorePluginManager", SimCorePluginManager()),
+        ("FilterManager", SimFilterManager()),
+        ("Core", SimCore()),
+        ("RPCServer", SimRPCServer())):
+      component.register(name, obj)
+
+    SimTorrent.simulator = self
+    SimTransfer.simulator = self
+
+    core.reactor = self.clock
+    core.time = self.clock
+    scheduling.time = self.clock
+    tracing.time = self.clock
+    stalls.time = self.clock
+    stalls.reactor = self.clock
+    core.Torrent = SimTorrent
+    core.ParallelTransfer = SimTransfer
+    core.deferToThread = maybeDeferred
+    core.get_file_size = self.get_file_size
+    core.get_allocated_size = self.get_allocated_size
+    core.get_device = self.get_device
+
+    self.core = core.Core(PLUGIN_NAME)
+    self.core.enable()
+    self.clock.advance(1)
+    self.core.set_settings(self.settings)
+
+  def run(self):
+    self._setup()
+
+    try:
+      for job in self.jobs:
+        self.clock.callLater(job.arrival, self._on_arrival, job)
+
+      start = self.clock.seconds()
+      while self.pending > 0:
+        calls = self.clock.getDelayedCalls()
+        next_time = min(c.getTime() for c in calls)
+        self.clock.advance(max(next_time - self.clock.seconds(), 0))
+        self._sample_progress()
+
+      return self.get_report(start)
+    finally:
+      self.core.disable()
+      shutil.rmtree(self.config_dir, ignore_errors=True)
+
+  def get_report(self, start):
+    jobs = [j for j in self.jobs if j.end is not None]
+    if not jobs:
+      return {"jobs": 0}
+
+    completion = sorted(j.end - (start + j.arrival) for j in jobs)
+    makespan = max(j.end for j in jobs) - start
+    busy = sum(j.end - j.start for j in jobs)
+
+    return {
+      "jobs": len(jobs),
+      "makespan": makespan,
+      "mean_completion": sum(completion) / len(completion),
+      "p95_completion": percentile(completion, 0.95),
+      "utilization": busy / (makespan or 1),
+      "mean_progress_error": mean(self.progress_errors),
+      "mean_speed_error": mean(self.speed_errors),
+      "final_estimated_speed": self.core.config["general"]["estimated_speed"],
+    }
+
+
+def mean(values):
+  return sum(values) / len(values) if values else 0.0
+
+
+def percentile(values, fraction):
+  index = int(math.ceil(fraction * len(values))) - 1
+  return values[max(index, 0)]
+
+
+def generate_trace(count, seed=0, interval=60.0, devices=("ssd", "hdd")):
+  rng = random.Random(seed)
+  entries = []
+  now = time.mktime((2014, 1, 1, 0, 0, 0, 0, 0, -1))
+  for i in range(count):
+    now += rng.expovariate(1.0 / interval)
+    entries.append({
+      "time": now,
+      "size": int(rng.lognormvariate(21, 1.5)),
+      "files": int(rng.lognormvariate(1.5, 1.5)) + 1,
+      "src_dev": devices[0],
+      "dest_dev": rng.choice(devices),
+    })
+
+  return entries
+
+
+def parse_rates(specs):
+  rates = {}
+  for spec in specs:
+    dev, _sep, rate = spec.rpartition("=")
+    rates[dev or None] = float(rate) * 2**20
+
+  return rates
+
+
+def main(args=None):
+  parser = optparse.OptionParser(
+    usage="%prog [options] [TRACE]",
+    description="Replay a trace of move requests against the %s core "
+      "logic under a virtual clock." % PLUGIN_NAME)
+  parser.add_option("-s", "--synthetic", type="int", metavar="COUNT",
+    help="replay a synthetic trace of COUNT moves")
+  parser.add_option("--seed", type="int", default=0,
+    help="seed for the synthetic trace (default: %default)")
+  parser.add_option("-r", "--rate", action="append", default=[],
+    metavar="[DEV=]MIBS", help="throughput of a device in MiB/s, or of "
+      "every other device if DEV is omitted (default: %d)" %
+      (DEFAULT_RATE/2**20))
+  parser.add_option("-l", "--file-latency", type="float",
+    default=DEFAULT_FILE_LATENCY,
+    help="seconds of overhead per file moved (default: %default)")
+  parser.add_option("-p", "--preallocate", action="store_true",
+    help="report full file sizes at the destination as soon as a move "
+      "starts, as with preallocated storage")
+  parser.add_option("-c", "--config", metavar="JSON",
+    help="plugin settings to apply, as for set_settings")
+  options, args = parser.parse_args(args)
+
+  if options.synthetic:
+    entries = generate_trace(options.synthetic, options.seed)
+  elif len(args) == 1:
+    entries = load_trace(args[0])
+  else:
+    parser.error("a trace file or --synthetic is required")
+
+  settings = json.loads(options.config) if options.config else None
+  simulator = Simulator(entries, parse_rates(options.rate),
+    options.file_latency, settings, options.preallocate)
+
+  report = simulator.run()
+  for key in sorted(report):
+    sys.stdout.write("%-24s %s\n" % (key, report[key]))
+
+
+if __name__ == "__main__":
+  sys.exit(main())
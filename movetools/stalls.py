@@ -0,0 +1,221 @@
+#
+# stalls.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import time
+import inspect
+import logging
+import functools
+
+from collections import deque
+
+from twisted.internet import reactor
+
+from common import PLUGIN_NAME
+
+
+log = logging.getLogger(__name__)
+
+
+def get_arg_sizes(names, args, kwargs):
+  sizes = {}
+  for name, value in zip(names, args) + kwargs.items():
+    try:
+      sizes[name] = len(value)
+    except TypeError:
+      pass
+
+  return sizes
+
+
+def timed(func):
+  names = inspect.getargspec(func).args[1:]
+
+  @functools.wraps(func)
+  def wrapper(self, *args, **kwargs):
+    watchdog = getattr(self, "watchdog", None)
+    if not (watchdog and watchdog.enabled):
+      return func(self, *args, **kwargs)
+
+    start = time.time()
+    watchdog.depth += 1
+    try:
+      return func(self, *args, **kwargs)
+    finally:
+      watchdog.depth -= 1
+      watchdog.record(func.__name__, start, time.time(), names, args, kwargs)
+
+  return wrapper
+
+
+class CallStats(object):
+
+  __slots__ = ("count", "total", "max", "slow", "args")
+
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+    self.slow = 0
+    self.args = None
+
+  def to_dict(self, name):
+    return {
+      "name": name,
+      "count": self.count,
+      "total": self.total,
+      "max": self.max,
+      "slow": self.slow,
+      "args": self.args,
+    }
+
+
+class Watchdog(object):
+
+  def __init__(self, threshold, interval, history):
+    self.enabled = False
+    self.depth = 0
+    self.threshold = threshold
+    self.interval = interval
+
+    self.calls = {}
+    self.slow_calls = deque(maxlen=history)
+    self.stalls = deque(maxlen=history)
+
+    self._heartbeat = None
+    self._expected = None
+    self._blocked = 0.0
+    self._worst = None
+
+  def start(self):
+    self.enabled = True
+    if not self._heartbeat:
+      self._schedule()
+
+  def stop(self):
+    self.enabled = False
+    if self._heartbeat and self._heartbeat.active():
+      self._heartbeat.cancel()
+    self._heartbeat = None
+
+  def resize(self, history):
+    if history != self.stalls.maxlen:
+      self.slow_calls = deque(self.slow_calls, maxlen=history)
+      self.stalls = deque(self.stalls, maxlen=history)
+
+  def clear(self):
+    self.calls.clear()
+    self.slow_calls.clear()
+    self.stalls.clear()
+
+  def _schedule(self):
+    self._expected = time.time() + self.interval
+    self._heartbeat = reactor.callLater(self.interval, self._beat)
+
+  def _beat(self):
+    now = time.time()
+    lag = now - self._expected
+
+    if lag >= self.threshold:
+      # Plugin calls since the last heartbeat account for at most this
+      # much of the stall
+      worst = self._worst
+      self.stalls.append({
+        "time": now,
+        "lag": lag,
+        "blocked": self._blocked,
+        "worst": worst[0] if worst else None,
+      })
+      if worst:
+        log.warning("[%s] Reactor stalled for %.3f s, %.3f s in plugin "
+          "calls (worst: %s %.3f s)", PLUGIN_NAME, lag, self._blocked,
+          worst[0], worst[1])
+      else:
+        log.warning("[%s] Reactor stalled for %.3f s outside of plugin calls",
+          PLUGIN_NAME, lag)
+
+    self._blocked = 0.0
+    self._worst = None
+    self._schedule()
+
+  def record(self, name, start, end, names, args, kwargs):
+    duration = end - start
+
+    stats = self.calls.get(name)
+    if stats is None:
+      stats = self.calls[name] = CallStats()
+
+    stats.count += 1
+    stats.total += duration
+
+    # Calls made from other timed calls are already part of their time
+    if not self.depth:
+      self._blocked += duration
+    if not self._worst or duration > self._worst[1]:
+      self._worst = (name, duration)
+
+    if duration < self.threshold:
+      stats.max = max(stats.max, duration)
+      return
+
+    # Argument sizes are only gathered for slow calls to keep timing cheap
+    sizes = get_arg_sizes(names, args, kwargs)
+    stats.slow += 1
+    if duration > stats.max:
+      stats.max = duration
+      stats.args = sizes
+
+    self.slow_calls.append({
+      "time": start,
+      "name": name,
+      "duration": duration,
+      "args": sizes,
+    })
+    log.warning("[%s] Slow call: %s took %.3f s (args: %s)", PLUGIN_NAME,
+      name, duration, sizes)
+
+  def get_report(self, count):
+    calls = sorted(self.calls.iteritems(), key=lambda c: c[1].max,
+      reverse=True)
+
+    return {
+      "calls": [stats.to_dict(name) for name, stats in calls[:count]],
+      "slow_calls": list(self.slow_calls),
+      "stalls": list(self.stalls),
+    }
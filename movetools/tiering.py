@@ -0,0 +1,189 @@
+#
+# tiering.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import os.path
+import time
+
+from array import array
+
+
+def get_relative_path(path, root):
+  path = os.path.normpath(path)
+  root = os.path.normpath(root)
+
+  if path == root:
+    return ""
+  if path.startswith(root.rstrip(os.sep) + os.sep):
+    return path[len(root.rstrip(os.sep))+1:]
+
+  return None
+
+
+class ActivityRing(object):
+
+  __slots__ = ("rates", "peers", "index", "count", "last_uploaded")
+
+  def __init__(self, size, uploaded):
+    self.rates = array("f", [0.0]) * size
+    self.peers = array("H", [0]) * size
+    self.index = 0
+    self.count = 0
+    self.last_uploaded = uploaded
+
+  def add(self, uploaded, peers, interval):
+    rate = max(uploaded - self.last_uploaded, 0) / float(interval)
+    self.last_uploaded = uploaded
+
+    self.rates[self.index] = rate
+    self.peers[self.index] = min(peers, 0xffff)
+    self.index = (self.index + 1) % len(self.rates)
+    self.count = min(self.count + 1, len(self.rates))
+
+  def is_full(self):
+    return self.count == len(self.rates)
+
+  def is_cold(self, max_rate, max_peers):
+    if not self.is_full():
+      return False
+
+    return max(self.rates) <= max_rate and max(self.peers) <= max_peers
+
+  def get_recent_rate(self, samples):
+    samples = min(samples, self.count)
+    if not samples:
+      return 0.0
+
+    size = len(self.rates)
+    total = sum(self.rates[(self.index - i - 1) % size]
+      for i in range(samples))
+    return total / samples
+
+
+class TieringPolicy(object):
+
+  def __init__(self, options):
+    self.options = options
+    self.rings = {}
+
+    self._day = None
+    self._used = 0
+
+  def get_ring_size(self):
+    options = self.options
+    return max(int(options["cold_days"] * 86400 / options["sample_interval"]),
+      1)
+
+  def sample(self, statuses):
+    size = self.get_ring_size()
+    interval = self.options["sample_interval"]
+
+    for id in self.rings.keys():
+      if id not in statuses:
+        del self.rings[id]
+
+    for id, status in statuses.iteritems():
+      ring = self.rings.get(id)
+      if ring is None or len(ring.rates) != size:
+        self.rings[id] = ActivityRing(size, status["total_uploaded"])
+      else:
+        ring.add(status["total_uploaded"], status["num_peers"], interval)
+
+  def reset(self, id):
+    self.rings.pop(id, None)
+
+  def get_budget(self):
+    day = time.localtime()[:3]
+    if day != self._day:
+      self._day = day
+      self._used = 0
+
+    budget = self.options["daily_budget"]
+    return budget - self._used if budget else None
+
+  def charge(self, size):
+    self.get_budget()
+    self._used += size
+
+  def select(self, statuses):
+    options = self.options
+    fast_path = options["fast_path"]
+    slow_path = options["slow_path"]
+
+    demote = []
+    promote = []
+    for id, ring in self.rings.iteritems():
+      status = statuses.get(id)
+      if not status or not status["is_finished"]:
+        continue
+
+      save_path = status["save_path"]
+
+      relative = get_relative_path(save_path, fast_path)
+      if relative is not None:
+        if ring.is_cold(options["max_upload_rate"], options["max_peers"]):
+          rate = ring.get_recent_rate(len(ring.rates))
+          demote.append((rate, id, os.path.join(slow_path, relative)))
+        continue
+
+      if not options["promote"]:
+        continue
+
+      relative = get_relative_path(save_path, slow_path)
+      if relative is not None:
+        rate = ring.get_recent_rate(options["promote_samples"])
+        if rate >= options["promote_upload_rate"]:
+          promote.append((-rate, id, os.path.join(fast_path, relative)))
+
+    # Hottest torrents are promoted first and coldest are demoted first
+    promote.sort()
+    demote.sort()
+
+    budget = self.get_budget()
+    moves = []
+    for rate, id, dest_path in promote + demote:
+      size = statuses[id]["total_size"]
+      if budget is not None:
+        if size > budget:
+          continue
+        budget -= size
+
+      moves.append((id, os.path.normpath(dest_path)))
+
+    return moves
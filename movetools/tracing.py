@@ -0,0 +1,114 @@
+#
+# tracing.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import json
+import time
+
+from collections import deque
+
+
+REACTOR_TID = 0
+
+
+class JobTracer(object):
+
+  def __init__(self, size):
+    self.enabled = False
+    self.events = deque(maxlen=size)
+
+  def resize(self, size):
+    if size != self.events.maxlen:
+      self.events = deque(self.events, maxlen=size)
+
+  def instant(self, name, id, args=None):
+    if self.enabled:
+      self.events.append((name, "i", time.time(), 0, id, args))
+
+  def complete(self, name, id, start, end=None, args=None):
+    if self.enabled:
+      end = time.time() if end is None else end
+      self.events.append((name, "X", start, end - start, id, args))
+
+  def clear(self):
+    self.events.clear()
+
+  def to_chrome(self):
+    # Each job gets its own row in the timeline, in order of appearance
+    tids = {}
+    events = []
+    for name, phase, ts, duration, id, args in self.events:
+      if id is None:
+        tid = REACTOR_TID
+      elif id in tids:
+        tid = tids[id]
+      else:
+        tid = tids[id] = len(tids) + 1
+
+      event = {
+        "name": name,
+        "cat": "job" if id else "reactor",
+        "ph": phase,
+        "ts": int(ts * 1e6),
+        "pid": 1,
+        "tid": tid,
+      }
+
+      if phase == "X":
+        event["dur"] = int(duration * 1e6)
+      else:
+        event["s"] = "t"
+
+      if args:
+        event["args"] = args
+
+      events.append(event)
+
+    names = [(REACTOR_TID, "reactor")]
+    names.extend((tid, id) for id, tid in tids.iteritems())
+    for tid, name in names:
+      events.append({
+        "name": "thread_name",
+        "ph": "M",
+        "pid": 1,
+        "tid": tid,
+        "args": {"name": name},
+      })
+
+    return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
@@ -0,0 +1,205 @@
+#
+# transfer.py
+#
+# Copyright (C) 2014 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import os
+import os.path
+import errno
+import shutil
+import logging
+import threading
+
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredList
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+from common import PLUGIN_NAME
+from common import rename_file
+from common import remove_empty_parents
+
+
+CHUNK_SIZE = 2**20
+
+
+log = logging.getLogger(__name__)
+
+
+class TransferStopped(Exception):
+  pass
+
+
+def makedirs(path):
+  try:
+    os.makedirs(path)
+  except OSError as e:
+    if e.errno != errno.EEXIST or not os.path.isdir(path):
+      raise
+
+
+class ParallelTransfer(object):
+
+  def __init__(self, src_path, dest_path, files, workers, large_file_size,
+      stage_path):
+    self.src_path = src_path
+    self.dest_path = dest_path
+    self.stage_path = stage_path
+    self.workers = max(int(workers), 1)
+
+    self.copied = 0
+    self.created = []
+    self.staged = []
+    self._lock = threading.Lock()
+    self._stopped = False
+
+    # Large files are copied one after another by a single worker to keep
+    # their I/O sequential, while the remaining workers share small files
+    files = sorted(files, key=lambda f: f[1], reverse=True)
+    self._large = deque(f for f in files if f[1] >= large_file_size)
+    self._small = deque(f for f in files if f[1] < large_file_size)
+
+    self._pool = None
+
+  def start(self):
+    self._pool = ThreadPool(0, self.workers, "%s-transfer" % PLUGIN_NAME)
+    self._pool.start()
+
+    tasks = []
+    small_workers = self.workers
+    if self._large:
+      tasks.append(self._run_worker(self._large))
+      small_workers = max(self.workers - 1, 1)
+
+    if self._small:
+      for i in range(small_workers):
+        tasks.append(self._run_worker(self._small))
+
+    d = DeferredList(tasks, fireOnOneErrback=True, consumeErrors=True)
+    d.addCallbacks(self._on_copied, self._on_failed)
+    d.addBoth(self._stop_pool)
+    return d
+
+  def stop(self):
+    self._stopped = True
+
+  def _run_worker(self, files):
+    return deferToThreadPool(reactor, self._pool, self._copy_files, files)
+
+  def _copy_files(self, files):
+    while not self._stopped:
+      try:
+        path, size = files.popleft()
+      except IndexError:
+        return
+
+      self._copy_file(path)
+
+    raise TransferStopped()
+
+  def _copy_file(self, path):
+    src = os.path.join(self.src_path, path)
+    dest = os.path.join(self.dest_path, path)
+
+    # Files that were never downloaded, such as unselected files, are
+    # skipped as libtorrent would
+    if not os.path.isfile(src):
+      return
+
+    makedirs(os.path.dirname(dest))
+
+    with open(src, "rb") as f_src:
+      # A file already at the destination may be shared with another
+      # torrent, so it is left alone and the source is left for libtorrent
+      try:
+        fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+      except OSError as e:
+        if e.errno != errno.EEXIST:
+          raise
+        log.debug("[%s] Skipping existing file: %s", PLUGIN_NAME, dest)
+        return
+
+      with self._lock:
+        self.created.append(path)
+
+      with os.fdopen(fd, "wb") as f_dest:
+        while True:
+          if self._stopped:
+            raise TransferStopped()
+
+          data = f_src.read(CHUNK_SIZE)
+          if not data:
+            break
+
+          f_dest.write(data)
+          with self._lock:
+            self.copied += len(data)
+
+    shutil.copymode(src, dest)
+
+  def _on_copied(self, result):
+    log.debug("[%s] Copied %d bytes to: %s", PLUGIN_NAME, self.copied,
+      self.dest_path)
+
+    # With the source files set aside, moving the storage only changes the
+    # save path of the torrent. They are removed once the move succeeds.
+    return deferToThreadPool(reactor, self._pool, self._stage_files)
+
+  def _stage_files(self):
+    for path in self.created:
+      src = os.path.join(self.src_path, path)
+      if not os.path.isfile(src):
+        continue
+
+      rename_file(src, os.path.join(self.stage_path, path))
+      self.staged.append(path)
+
+    remove_empty_parents(self.src_path, self.staged)
+
+  def _on_failed(self, failure):
+    self._stopped = True
+
+    # Unwrap the first failure from the DeferredList
+    return failure.value.subFailure
+
+  def _stop_pool(self, result):
+    self._pool.stop()
+    return result
+
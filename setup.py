@@ -42,7 +42,7 @@ from setuptools import setup
 __plugin_name__ = "MoveTools"
 __author__ = "Ratanak Lun"
 __author_email__ = "ratanakvlun@gmail.com"
-__version__ = "0.2.0.2"
+__version__ = "0.2.1.0"
 __url__ = "http://github.com/ratanakvlun"
 __license__ = "GPLv3"
 __description__ = "Tools for moving torrents"
@@ -69,5 +69,8 @@ setup(
     %s = %s:GtkUIPlugin
     [deluge.plugin.web]
     %s = %s:WebUIPlugin
-    """ % ((__plugin_name__, __plugin_name__.lower())*3)
+    [console_scripts]
+    deluge-%s = %s.console:main
+    """ % ((__plugin_name__, __plugin_name__.lower())*3 +
+      (__plugin_name__.lower(),)*2)
 )